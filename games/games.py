@@ -20,12 +20,12 @@
 
 import operator
 import random
-import sys
 import os
 import re
 from abc import ABCMeta, abstractmethod
 
 import utils
+from prefetch import Prefetcher
 from utils import InputTimedOut
 
 
@@ -37,7 +37,8 @@ class Game(metaclass=ABCMeta):
     based on a simple loop of questions and answers.
 
     To create a game, build a subclass that provides name_id and name
-    to the parent and overrides the run method (that's the minimum required).
+    to the parent and overrides the run method (that's the minimum required),
+    or a subclass of StepGame.
     Optionally, you can override setup and game_loop methods also.
     The standard game_loop method will show a description of the game if
     the subclass defines the attribute self.description.
@@ -54,13 +55,18 @@ class Game(metaclass=ABCMeta):
 
     setup:     instance method. Returns the dictionary of options that will be
                passed to the run method. The standard implementation provides
-               the user with a choice amongst four levels of difficulty
-               (novice, intermediate, expert and master), that will set
-               the value for the 'max_value' key in the opts dictionary.
+               the user with a choice amongst the levels of difficulty in
+               self.levels (novice, intermediate, expert and master), and
+               passes the chosen index to the options method.
                The method set_difficulty, called during the execution of setup,
                also sets the optional attribute self.difficulty (a string) that
                will be used when saving high scores.
 
+    options:   instance method. Receives the index of a difficulty level
+               (starting from 0) and returns the dictionary of options for
+               that level without asking anything to the user. The standard
+               implementation sets only the 'max_value' key.
+
     game_loop: instance method. Main game loop.
                First, shows a description of the game if the attribute
                self.description is set.
@@ -80,6 +86,8 @@ class Game(metaclass=ABCMeta):
                score value is returned as an integer value.
 
     """
+    levels = ('Novice', 'Intermediate', 'Expert', 'Master')
+
     def __init__(self, name_id: str, name: str, *args, **kwargs) -> None:
         """
         :param name_id: a string. It's a human readable id,
@@ -108,13 +116,17 @@ class Game(metaclass=ABCMeta):
         return False
 
     def setup(self) -> dict:
-        return self.set_max_value()
+        return self.options(self.set_difficulty() - 1)
+
+    def options(self, level: int) -> dict:
+        return {'max_value': (15, 127, 255, 4095)[level]}
 
     def set_max_value(self, values: tuple = (15, 127, 255, 4095)) -> dict:
         return {'max_value': values[self.set_difficulty() - 1]}
 
-    def set_difficulty(self, levels: tuple = ('Novice', 'Intermediate',
-                                              'Expert', 'Master')) -> int:
+    def set_difficulty(self, levels: tuple = None) -> int:
+        if levels is None:
+            levels = self.levels
         user_input = ''
         prompt = 'Set difficulty:\n'
         for i, level in enumerate(levels, start=1):
@@ -176,7 +188,87 @@ class Game(metaclass=ABCMeta):
         return score
 
 
-class Bin2Hex3Secs(Game):
+class StepGame(Game):
+
+    """
+    Base class for games whose turns can be split in steps.
+
+    Subclasses don't override run, but the three methods below. A StepGame
+    can also be played one answer at a time through session.GameSession.
+
+    question:  instance method. Receives the dictionary of options and a
+               randint function (with the same signature of random.randint),
+               that must be the only source of randomness. Returns the new
+               question as a tuple of integers.
+    prompt:    instance method. Returns the text shown to the user for the
+               question.
+    check:     instance method. Returns True if the answer (a string) to the
+               question is right. Can raise InputTimedOut for answers that
+               make no sense.
+
+    The optional 'time_limit' key of the options is the timeout (in seconds)
+    for the user input.
+
+    While game_loop is running, the questions are drawn in advance by a
+    prefetch.Prefetcher (seeded with random.getrandbits), so that the next
+    one is ready while the user answers. The optional 'prefetch_depth' key
+    of the options (defaults to 4) is how many questions are drawn ahead.
+    """
+    _prefetcher = None
+
+    @abstractmethod
+    def question(self, opts: dict, randint) -> tuple:
+        return ()
+
+    @abstractmethod
+    def prompt(self, opts: dict, question: tuple) -> str:
+        return ''
+
+    @abstractmethod
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
+        return False
+
+    def ask(self, opts: dict, question: tuple) -> bool:
+        answer = utils.read_input(self.prompt(opts, question), opts.get('time_limit', 0))
+        return self.check(opts, question, answer)
+
+    def draw(self, opts: dict, state: int) -> tuple:
+        """
+        Draw the question that follows the state of a utils.SplitMix64
+        generator, without touching the random module.
+
+        :return: a tuple (new state, question)
+        """
+        rng = utils.SplitMix64(state)
+        question = self.question(opts, rng.randint)
+        return rng.state, question
+
+    def setup(self) -> dict:
+        opts = super().setup()
+        # closed by game_loop, when the game is over
+        self._prefetcher = Prefetcher(self, opts, random.getrandbits(64),
+                                      opts.get('prefetch_depth', 4))
+        return opts
+
+    def game_loop(self) -> int:
+        try:
+            return super().game_loop()
+        finally:
+            if self._prefetcher is not None:
+                self._prefetcher.close()
+                self._prefetcher = None
+
+    def run(self, opts: dict) -> bool:
+        if self._prefetcher is None:  # run outside of game_loop
+            question = self.question(opts, random.randint)
+        else:
+            question = self._prefetcher.get()[1]
+        return self.ask(opts, question)
+
+
+class Bin2Hex3Secs(StepGame):
+
+    levels = ('Novice', 'Intermediate', 'Expert')
 
     def __init__(self, name_id: str, *args, **kwargs) -> None:
         self.name_id = name_id  # 'game_3_sec'
@@ -187,11 +279,15 @@ class Bin2Hex3Secs(Game):
                            "You'll have three seconds for every number.\n" \
                            "Three errors allowed."
 
-    def setup(self) -> dict:
-        return self.set_max_value(values=(15, 255, 65535))
+    def options(self, level: int) -> dict:
+        return {'max_value': (15, 255, 65535)[level],
+                'time_limit': 3}
+
+    def question(self, opts: dict, randint) -> tuple:
+        return randint(1, opts['max_value']),
 
-    def run(self, opts: dict) -> int:
-        a = random.randint(1, opts['max_value'])
+    def prompt(self, opts: dict, question: tuple) -> str:
+        a = question[0]
         digits = 0
         a_ = a
         while a_ > 0:
@@ -201,17 +297,18 @@ class Bin2Hex3Secs(Game):
         pres_a = bin(a)[2:].rjust(digits, '0')
         for _ in range(len(pres_a), 0, -4):
             pres_a = pres_a[:_] + ' ' + pres_a[_:]
-        print(pres_a)
-        b = utils.read_input('What is the correspondent hex? ', 3)
-        hex_a = hex(a)
-        if '{}{}'.format('0x' if not str(b).startswith('0x') else "",
-                         str(b).casefold().lstrip('0')) == hex_a.casefold():
+        return '{}\nWhat is the correspondent hex? '.format(pres_a)
+
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
+        hex_a = hex(question[0])
+        if '{}{}'.format('0x' if not str(answer).startswith('0x') else "",
+                         str(answer).casefold().lstrip('0')) == hex_a.casefold():
             return True
         else:
             return False
 
 
-class HexArithm(Game):
+class HexArithm(StepGame):
 
     def __init__(self, name_id: str, name : str = 'Hex arithmetic',
                  operation: tuple = (), *args, **kwargs) -> None:
@@ -235,27 +332,37 @@ class HexArithm(Game):
                   'difficulty_coefficient': 0x08}
             )
 
-    def setup(self):
-        opts = self.set_max_value()
+    def options(self, level: int) -> dict:
+        opts = super().options(level)
         opts['operation'] = self.operation
+        opts['time_limit'] = 10
         return opts
 
-    def run(self, opts: dict) -> bool:
-        a = random.randint(0, opts['max_value'])
-        b = random.randint(0, opts['max_value'])
-
-        operator_index = random.randint(0, len(opts['operation'])-1)
-        arithmetic_operator = opts['operation'][operator_index]['operator']
-        coefficient = opts['operation'][operator_index].get('difficulty_coefficient', 1)
-        a //= coefficient
-        b //= coefficient
+    def question(self, opts: dict, randint) -> tuple:
+        a = randint(0, opts['max_value'])
+        b = randint(0, opts['max_value'])
+        operator_index = randint(0, len(opts['operation'])-1)
+        return a, b, operator_index
 
-        hexa, hexb = hex(a)[2:], hex(b)[2:]
-        result = arithmetic_operator(a, b)
+    def _operands(self, opts: dict, question: tuple) -> tuple:
+        """
+        :return: a tuple (a, b, operation) with the operands scaled by the
+                 difficulty coefficient of the operation
+        """
+        a, b, operator_index = question
+        operation = opts['operation'][operator_index]
+        coefficient = operation.get('difficulty_coefficient', 1)
+        return a // coefficient, b // coefficient, operation
+
+    def prompt(self, opts: dict, question: tuple) -> str:
+        a, b, operation = self._operands(opts, question)
+        return '{} {} {} = '.format(hex(a)[2:], operation['glyph'], hex(b)[2:])
+
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
+        a, b, operation = self._operands(opts, question)
+        result = operation['operator'](a, b)
         sign = '-' if result < 0 else ''
         hexresult = sign + hex(abs(result)).lower()[2:]
-        answer = utils.read_input('{} {} {} = '.format(
-                hexa, opts['operation'][operator_index]['glyph'], hexb), 10)
         answer = answer.lower()
         if re.fullmatch(r'-?(?:0x)?0+', answer):
             # if answer means 0, let be only '0'
@@ -306,7 +413,7 @@ class HexDiff(HexArithm):
                            self.standard_description
 
 
-class Hex2Dec(Game):
+class Hex2Dec(StepGame):
 
     def __init__(self, name_id: str, *args, **kwargs) -> None:
         self.name_id = name_id
@@ -316,22 +423,30 @@ class Hex2Dec(Game):
                            "You'll have six seconds for every number.\n" + \
                            self.standard_description
 
-    def run(self, opts: dict) -> bool:
-        a = random.randint(1, opts['max_value'])
-        repr_a = hex(a)[2:].rjust(2, '0')
-        print(repr_a)
-        b = utils.read_input('What is the correspondent decimal? ', 6)
+    def options(self, level: int) -> dict:
+        opts = super().options(level)
+        opts['time_limit'] = 6
+        return opts
+
+    def question(self, opts: dict, randint) -> tuple:
+        return randint(1, opts['max_value']),
+
+    def prompt(self, opts: dict, question: tuple) -> str:
+        repr_a = hex(question[0])[2:].rjust(2, '0')
+        return '{}\nWhat is the correspondent decimal? '.format(repr_a)
+
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
         try:
-            b = int(b)
+            b = int(answer)
         except ValueError:
             raise InputTimedOut
-        if b == a:
+        if b == question[0]:
             return True
         else:
             return False
 
 
-class Dec2Hex(Game):
+class Dec2Hex(StepGame):
 
     def __init__(self, name_id: str, *args, **kwargs) -> None:
         self.name_id = name_id
@@ -341,21 +456,29 @@ class Dec2Hex(Game):
                            "You'll have six seconds for every number.\n" + \
                            self.standard_description
 
-    def run(self, opts: dict) -> bool:
-        a = random.randint(1, opts['max_value'])
-        print(a)
-        b = utils.read_input('What is the correspondent hexadecimal? ', 6)
+    def options(self, level: int) -> dict:
+        opts = super().options(level)
+        opts['time_limit'] = 6
+        return opts
+
+    def question(self, opts: dict, randint) -> tuple:
+        return randint(1, opts['max_value']),
+
+    def prompt(self, opts: dict, question: tuple) -> str:
+        return '{}\nWhat is the correspondent hexadecimal? '.format(question[0])
+
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
         try:
-            b = int(b, base=16)
+            b = int(answer, base=16)
         except ValueError:
             raise InputTimedOut
-        if b == a:
+        if b == question[0]:
             return True
         else:
             return False
 
 
-class RecognizeWord(Game):
+class RecognizeWord(StepGame):
 
     def __init__(self, name_id: str, *args, **kwargs) -> None:
         self.name_id = name_id
@@ -366,7 +489,7 @@ class RecognizeWord(Game):
                            "Novice: you'll have twenty seconds for every word; " \
                            "intermediate: fifteen seconds; "
 
-    def setup(self) -> dict:
+    def options(self, level: int) -> dict:
         try:
             words_set = set()
             with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),
@@ -380,22 +503,23 @@ class RecognizeWord(Game):
                          'penna', 'canapa', 'scottex', 'mouse', 'cotone', 'finestra',
                          'tavolo', 'rock'}
         seconds = (20, 15, 10, 5)
-        time_for_answer = seconds[self.set_difficulty() - 1]
-        options = {'words_set': words_set,
-                   'time_for_answer': time_for_answer}
+        # sorted, so that a word can be identified by its index
+        options = {'words': tuple(sorted(words_set)),
+                   'time_limit': seconds[level]}
         return options
 
-    def run(self, opts: dict) -> bool:
-        word = random.sample(opts['words_set'], 1)[0]
-        print('Code points:')
+    def question(self, opts: dict, randint) -> tuple:
+        return randint(0, len(opts['words'])-1),
+
+    def prompt(self, opts: dict, question: tuple) -> str:
+        word = opts['words'][question[0]]
+        code_points = ''
         for char_ in word:
-            try:
-                print('{:>02} '.format(hex(ord(char_))[2:]), end='')
-            except ValueError:
-                print(sys.exc_info())
-        print('')
-        answer = utils.read_input('Write the word: ', opts['time_for_answer'])
-        if word == answer:
+            code_points += '{:>02} '.format(hex(ord(char_))[2:])
+        return 'Code points:\n{}\nWrite the word: '.format(code_points)
+
+    def check(self, opts: dict, question: tuple, answer: str) -> bool:
+        if opts['words'][question[0]] == answer:
             return True
         else:
             return False
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Copyright (c) 2017 Francesco Martini
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import queue
+import threading
+
+
+class Prefetcher:
+
+    """
+    Bounded producer/consumer pipeline of questions.
+
+    A worker thread draws the questions of a StepGame that follow a random
+    state and keeps up to depth of them in a queue, so that the next question
+    is ready while the player is still answering the current one. The
+    questions come out in the same order StepGame.draw would give them.
+    Every item is tagged with a generation, that restart increments: stale
+    items still in the queue (or being drawn) are discarded by get.
+    If drawing raises an exception, get raises it too.
+
+    The worker thread lives until close is called.
+    """
+    def __init__(self, game, opts: dict, state: int, depth: int = 4) -> None:
+        """
+        :param depth: maximum number of questions drawn in advance (at least 1).
+        """
+        if depth < 1:
+            raise ValueError('depth must be at least 1, not {}'.format(depth))
+        self._queue = queue.Queue(maxsize=depth)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._game = game
+        self._opts = opts
+        self._state = state
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self) -> None:
+        while not self._closed.is_set():
+            with self._lock:
+                generation, opts, state = self._generation, self._opts, self._state
+            try:
+                state, question = self._game.draw(opts, state)
+            except Exception as exc:
+                # the same error is drawn again until restart: the queue
+                # being bounded, the worker just blocks on it
+                self._queue.put((generation, None, None, exc))
+                continue
+            with self._lock:
+                if generation == self._generation:
+                    self._state = state
+            self._queue.put((generation, state, question, None))
+
+    def get(self) -> tuple:
+        """
+        :return: a tuple (new state, question), like StepGame.draw
+        """
+        while True:
+            if self._closed.is_set():
+                raise ValueError('get from a closed Prefetcher')
+            generation, state, question, error = self._queue.get()
+            if generation != self._generation:
+                continue
+            if error is not None:
+                raise error
+            return state, question
+
+    def restart(self, opts: dict, state: int) -> None:
+        """
+        Invalidate the prefetched questions and start again from state,
+        with new options.
+        """
+        with self._lock:
+            self._generation += 1
+            self._opts = opts
+            self._state = state
+
+    def close(self) -> None:
+        self._closed.set()
+        # make room in the queue, so that the worker can see it's closed
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        # the worker puts at most one more item, and the queue has room for it
+        self._thread.join()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Copyright (c) 2017 Francesco Martini
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import gc
+import random
+import sys
+import tracemalloc
+from types import MappingProxyType
+
+from numconv import GAMES
+from games.games import StepGame
+from prefetch import Prefetcher
+from utils import InputTimedOut, SplitMix64
+
+
+class GameOver(Exception):
+    pass
+
+
+# options are built once for every (game_id, level) and shared by all sessions,
+# so they are read-only
+_OPTIONS = {}
+
+
+def options(game_id: int, level: int) -> MappingProxyType:
+    try:
+        return _OPTIONS[game_id, level]
+    except KeyError:
+        opts = _OPTIONS[game_id, level] = MappingProxyType(GAMES[game_id].options(level))
+        return opts
+
+
+def draw(game_id: int, level: int, state: int) -> tuple:
+    """
+    Draw the question that follows the random state.
+
+    :return: a tuple (new state, question)
+    """
+    return GAMES[game_id].draw(options(game_id, level), state)
+
+
+class GameSession:
+
+    """
+    A game played one answer at a time, without blocking on user input.
+
+    It follows the same rules of Game.game_loop, but keeps only small
+    integers: the index of the game in numconv.GAMES, the index of the
+    difficulty level, score, errors, the state of the random generator
+    and the current question. Everything else (games and their options)
+    is shared by all the sessions, so that a very large number of idle
+    players can be kept in memory (from 190 to 240 bytes each, depending on
+    the game, as printed by running this module).
+
+    The game must be a StepGame. When the game is over (more errors than
+    allowed), answer and timeout raise GameOver.
+    """
+    __slots__ = ('game_id', 'level', 'score', 'errors', 'state', 'question')
+
+    def __init__(self, game_id: int, level: int, seed: int = None) -> None:
+        """
+        :param game_id: index of the game in numconv.GAMES.
+        :param level: index of the difficulty level (starting from 0).
+        :param seed: seed for the questions. If None, a random one is used.
+        """
+        if not isinstance(GAMES[game_id], StepGame):
+            raise TypeError('{} is not a StepGame'.format(GAMES[game_id].name_id))
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.game_id = game_id
+        self.check_level(level)
+        self.level = level
+        self.score = 0
+        self.errors = 0
+        self.state = seed & SplitMix64.MASK
+        self.state, self.question = draw(game_id, level, self.state)
+
+    @property
+    def game(self):
+        return GAMES[self.game_id]
+
+    @property
+    def opts(self) -> MappingProxyType:
+        return options(self.game_id, self.level)
+
+    @property
+    def difficulty(self) -> str:
+        return self.game.levels[self.level]
+
+    @property
+    def prompt(self) -> str:
+        return self.game.prompt(self.opts, self.question)
+
+    @property
+    def time_limit(self) -> int:
+        return self.opts.get('time_limit', 0)
+
+    @property
+    def over(self) -> bool:
+        return self.errors > self.opts.get('allowed_errors', 3)
+
+    def answer(self, answer: str) -> bool:
+        """
+        Check the answer to the current question and move to the next one.
+
+        :return: True if the answer was right
+        """
+        if self.over:
+            raise GameOver
+        try:
+            right = self.game.check(self.opts, self.question, answer)
+        except InputTimedOut:
+            self.timeout()
+            return False
+        if right:
+            self.score += 1
+        else:
+            self.score -= self.opts.get('error_penalty', 0)
+            self.errors += 1
+        self.next_question()
+        return right
+
+    def timeout(self) -> None:
+        """
+        Count the current question as timed out and move to the next one.
+        """
+        if self.over:
+            raise GameOver
+        self.score -= self.opts.get('timeout_penalty', 0)
+        self.errors += 1
+        self.next_question()
+
+    def next_question(self) -> None:
+        self.state, self.question = draw(self.game_id, self.level, self.state)
+
+    def check_level(self, level: int) -> None:
+        if not 0 <= level < len(GAMES[self.game_id].levels):
+            raise IndexError('level {} out of range for {}'.format(
+                    level, GAMES[self.game_id].name_id))
+
+    def set_level(self, level: int) -> None:
+        """
+        Change the difficulty level. The current question is replaced with
+        one of the new level.
+        """
+        self.check_level(level)
+        self.level = level
+        self.next_question()
+
+
+class PrefetchingSession(GameSession):
+
+    """
+    GameSession whose next questions are drawn in advance by a Prefetcher.
+    Questions are the same (and in the same order) of a GameSession with
+    the same seed.
+
+    Every PrefetchingSession holds a worker thread until close is called,
+    so it's meant for the sessions that are being played, not for the idle
+    ones: use it as a context manager, or call close. After close, the
+    session goes on drawing its questions like a GameSession.
+    """
+    __slots__ = ('prefetcher',)
+
+    def __init__(self, game_id: int, level: int, seed: int = None, depth: int = 4) -> None:
+        """
+        :param depth: maximum number of questions drawn in advance (at least 1).
+        """
+        super().__init__(game_id, level, seed)
+        self.prefetcher = Prefetcher(self.game, self.opts, self.state, depth)
+
+    def __enter__(self) -> 'PrefetchingSession':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def next_question(self) -> None:
+        if self.prefetcher is None:
+            super().next_question()
+        else:
+            self.state, self.question = self.prefetcher.get()
+
+    def set_level(self, level: int) -> None:
+        self.check_level(level)
+        self.level = level
+        if self.prefetcher is not None:
+            self.prefetcher.restart(self.opts, self.state)
+        self.next_question()
+
+    def close(self) -> None:
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+
+def measure(game_id: int, level: int, number: int = 100000) -> float:
+    """
+    :return: the average memory (in bytes) taken by number sessions
+    """
+    GameSession(game_id, level)  # build the shared options out of the measure
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [GameSession(game_id, level) for _ in range(number)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # don't count the list that holds the sessions
+    return (after - before - sys.getsizeof(sessions)) / len(sessions)
+
+
+if __name__ == '__main__':
+    for game_id_, game_ in enumerate(GAMES):
+        level_ = len(game_.levels) - 1
+        print('{:<28}{:>8.1f} bytes per session'.format(game_.name_id,
+                                                        measure(game_id_, level_)))
@@ -10,6 +10,28 @@ class InputTimedOut(Exception):
     pass
 
 
+class SplitMix64:
+
+    """
+    Pseudo random generator whose whole state is a single 64 bits integer,
+    so that the state can be saved and resumed cheaply.
+    """
+    MASK = (1 << 64) - 1
+
+    def __init__(self, state: int) -> None:
+        self.state = state & self.MASK
+
+    def randint(self, a: int, b: int) -> int:
+        """
+        Same as random.randint.
+        """
+        self.state = (self.state + 0x9E3779B97F4A7C15) & self.MASK
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & self.MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & self.MASK
+        return a + (z ^ (z >> 31)) % (b - a + 1)
+
+
 if os.name == 'posix':
     import signal
 